@@ -46,7 +46,8 @@ CREATE TABLE IF NOT EXISTS parameterType (
     canonical_unit VARCHAR(50),
     data_type VARCHAR(50) NOT NULL, -- 'float', 'integer', 'boolean'
     normal_min FLOAT,
-    normal_max FLOAT
+    normal_max FLOAT,
+    precision FLOAT DEFAULT 0 -- deadband: changes smaller than this are noise
 );
 
 CREATE TABLE IF NOT EXISTS deviceParameterMapping (
@@ -115,25 +116,25 @@ INSERT INTO location (field_id, name, latitude, longitude) VALUES
 (1, 'Pad B', 60.125, -97.458);
 
 -- 2. Create All 18 Parameter Types
-INSERT INTO parameterType (parameter_type_id, code, display_name, canonical_unit, data_type, normal_min, normal_max) VALUES
-(1, 'tubing_pressure', 'Tubing Pressure', 'psi', 'float', 500, 3000),
-(2, 'casing_pressure', 'Casing Pressure', 'psi', 'float', 200, 2000),
-(3, 'annulus_pressure', 'Annulus Pressure', 'psi', 'float', 50, 500),
-(4, 'wellhead_temperature', 'Wellhead Temperature', '°F', 'float', 60, 250),
-(5, 'choke_valve_position', 'Choke Valve Position', '%', 'integer', 0, 100),
-(6, 'flow_rate', 'Flow Rate', 'bbl/day', 'float', 100, 5000),
-(7, 'gas_oil_ratio', 'Gas Oil Ratio', 'scf/stb', 'float', 500, 3000),
-(8, 'water_cut', 'Water Cut', '%', 'float', 0, 80),
-(9, 'sand_detector', 'Sand Detector', 'ppm', 'float', 0, 100),
-(10, 'corrosion_rate', 'Corrosion Rate', 'mpy', 'float', 0, 10),
-(11, 'h2s_level', 'H2S Level', 'ppm', 'float', 0, 50),
-(12, 'co2_level', 'CO2 Level', '%', 'float', 0, 5),
-(13, 'vibration', 'Vibration', 'mm/s', 'float', 0, 5),
-(14, 'master_valve_status', 'Master Valve Status', 'state', 'boolean', 0, 1),
-(15, 'wing_valve_status', 'Wing Valve Status', 'state', 'boolean', 0, 1),
-(16, 'swab_valve_status', 'Swab Valve Status', 'state', 'boolean', 0, 1),
-(17, 'emergency_shutdown', 'Emergency Shutdown', 'state', 'boolean', 0, 1),
-(18, 'pump_status', 'Pump Status', 'state', 'boolean', 0, 1);
+INSERT INTO parameterType (parameter_type_id, code, display_name, canonical_unit, data_type, normal_min, normal_max, precision) VALUES
+(1, 'tubing_pressure', 'Tubing Pressure', 'psi', 'float', 500, 3000, 1.0),
+(2, 'casing_pressure', 'Casing Pressure', 'psi', 'float', 200, 2000, 1.0),
+(3, 'annulus_pressure', 'Annulus Pressure', 'psi', 'float', 50, 500, 0.5),
+(4, 'wellhead_temperature', 'Wellhead Temperature', '°F', 'float', 60, 250, 0.5),
+(5, 'choke_valve_position', 'Choke Valve Position', '%', 'integer', 0, 100, 1),
+(6, 'flow_rate', 'Flow Rate', 'bbl/day', 'float', 100, 5000, 5),
+(7, 'gas_oil_ratio', 'Gas Oil Ratio', 'scf/stb', 'float', 500, 3000, 5),
+(8, 'water_cut', 'Water Cut', '%', 'float', 0, 80, 0.1),
+(9, 'sand_detector', 'Sand Detector', 'ppm', 'float', 0, 100, 0.5),
+(10, 'corrosion_rate', 'Corrosion Rate', 'mpy', 'float', 0, 10, 0.05),
+(11, 'h2s_level', 'H2S Level', 'ppm', 'float', 0, 50, 0.1),
+(12, 'co2_level', 'CO2 Level', '%', 'float', 0, 5, 0.01),
+(13, 'vibration', 'Vibration', 'mm/s', 'float', 0, 5, 0.01),
+(14, 'master_valve_status', 'Master Valve Status', 'state', 'boolean', 0, 1, 0.5),
+(15, 'wing_valve_status', 'Wing Valve Status', 'state', 'boolean', 0, 1, 0.5),
+(16, 'swab_valve_status', 'Swab Valve Status', 'state', 'boolean', 0, 1, 0.5),
+(17, 'emergency_shutdown', 'Emergency Shutdown', 'state', 'boolean', 0, 1, 0.5),
+(18, 'pump_status', 'Pump Status', 'state', 'boolean', 0, 1, 0.5);
 
 -- 3. Create 12 Wellheads and their associated Devices and Mappings
 -- We use a DO block to programmatically create the assets and mappings.
@@ -237,4 +238,102 @@ $$ LANGUAGE plpgsql;
 CREATE TRIGGER wellhead_readings_alarm_trigger
 AFTER INSERT ON parameterReading
 FOR EACH ROW
-EXECUTE FUNCTION check_wellhead_alarms();
\ No newline at end of file
+EXECUTE FUNCTION check_wellhead_alarms();
+
+-- =================================================================
+-- WIDE-ROW HISTORIAN TABLE
+-- One row per (wellhead, timestamp) with one column per parameter.
+-- The columns are generated from the parameterType catalog so the
+-- table stays in sync with the metadata seeded above. The ingestion
+-- service streams into this table with binary COPY.
+-- =================================================================
+
+DO $$
+DECLARE
+    param_columns TEXT;
+BEGIN
+    SELECT string_agg(quote_ident(code) || ' DOUBLE PRECISION', ', ' ORDER BY parameter_type_id)
+    INTO param_columns
+    FROM parameterType;
+
+    EXECUTE format(
+        'CREATE TABLE IF NOT EXISTS wellhead_readings (
+            reading_id BIGSERIAL,
+            time TIMESTAMPTZ NOT NULL,
+            wellhead_id INT NOT NULL REFERENCES wellHead(wellhead_id) ON DELETE CASCADE,
+            %s,
+            PRIMARY KEY (reading_id, time)
+        )', param_columns);
+END $$;
+
+-- At a 5-30s poll cadence a day of readings fits comfortably in one
+-- chunk, keeping the active chunk (and its indexes) hot in memory.
+SELECT create_hypertable('wellhead_readings', 'time', chunk_time_interval => INTERVAL '1 day');
+
+-- Compress chunks older than a week, segmented per wellhead so typical
+-- single-wellhead trend queries scan columnar data, and age raw data out
+-- after 90 days.
+ALTER TABLE wellhead_readings SET (
+    timescaledb.compress,
+    timescaledb.compress_segmentby = 'wellhead_id',
+    timescaledb.compress_orderby = 'time DESC, reading_id'
+);
+SELECT add_compression_policy('wellhead_readings', INTERVAL '7 days');
+SELECT add_retention_policy('wellhead_readings', INTERVAL '90 days');
+
+-- Alarm checking for wide rows: every parameter column of the new row is
+-- evaluated against the active rules for its parameter type.
+CREATE OR REPLACE FUNCTION check_wellhead_alarms_wide()
+RETURNS TRIGGER AS $$
+DECLARE
+    rule record;
+    is_active BOOLEAN;
+    reading_value FLOAT;
+    row_data jsonb := to_jsonb(NEW);
+BEGIN
+    FOR rule IN
+        SELECT ar.*, pt.code
+        FROM alarmRule ar
+        JOIN parameterType pt ON ar.parameter_type_id = pt.parameter_type_id
+        WHERE ar.active = TRUE
+    LOOP
+        reading_value := (row_data ->> rule.code)::FLOAT;
+        CONTINUE WHEN reading_value IS NULL;
+
+        -- Check if an alarm for this rule and wellhead is already active
+        SELECT EXISTS(
+            SELECT 1 FROM alarmEvent
+            WHERE wellhead_id = NEW.wellhead_id
+            AND alarm_rule_id = rule.alarm_rule_id
+            AND cleared_at IS NULL
+        ) INTO is_active;
+
+        -- Evaluate the rule condition
+        IF (rule.operator = '>' AND reading_value > rule.threshold_value) OR
+           (rule.operator = '<' AND reading_value < rule.threshold_value) OR
+           (rule.operator = '==' AND reading_value = rule.threshold_value) THEN
+
+            -- If condition is met and no alarm is active, create a new alarm event
+            IF NOT is_active THEN
+                INSERT INTO alarmEvent (alarm_rule_id, parameter_reading_id, wellhead_id, timestamp_utc, triggered_at, severity_level, triggered_value)
+                VALUES (rule.alarm_rule_id, NEW.reading_id, NEW.wellhead_id, NEW.time, NEW.time, rule.severity_level, reading_value);
+            END IF;
+        ELSE
+            -- If condition is NOT met but an alarm IS active, clear it
+            IF is_active THEN
+                UPDATE alarmEvent
+                SET cleared_at = NEW.time
+                WHERE wellhead_id = NEW.wellhead_id
+                AND alarm_rule_id = rule.alarm_rule_id
+                AND cleared_at IS NULL;
+            END IF;
+        END IF;
+    END LOOP;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER wellhead_readings_wide_alarm_trigger
+AFTER INSERT ON wellhead_readings
+FOR EACH ROW
+EXECUTE FUNCTION check_wellhead_alarms_wide();
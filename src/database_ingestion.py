@@ -1,11 +1,26 @@
+import asyncio
+import logging
+import socket
 import time
 import os
+import asyncpg
+import numpy as np
 import psycopg2
 from datetime import datetime, timezone
-from psycopg2.extras import execute_batch
-from pymodbus.client.sync import ModbusTcpClient
-from pymodbus.payload import BinaryPayloadDecoder
-from pymodbus.constants import Endian
+from pymodbus.client import AsyncModbusTcpClient, ModbusTcpClient
+from pymodbus.exceptions import ModbusException
+
+from service_utils import wait_for
+
+# uvloop replaces the default event loop with a libuv-backed one, cutting
+# the per-await overhead of the many concurrent Modbus reads. Optional:
+# the service runs unchanged on the stock loop when it is not installed.
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+log = logging.getLogger(__name__)
 
 # Config from environment variables
 MODBUS_HOST = os.getenv('MODBUS_HOST', 'modbus')
@@ -16,12 +31,25 @@ DB_NAME = os.getenv('POSTGRES_DB')
 DB_USER = os.getenv('POSTGRES_USER')
 DB_PASSWORD = os.getenv('POSTGRES_PASSWORD')
 POLL_INTERVAL = 5  # seconds
+MAX_READ_SPAN = 125  # Modbus spec limit on registers per read request
+MAX_BUFFERED_ROWS = 500  # wide rows accumulated across polls before a COPY flush
+MAX_BATCH_AGE = 30  # seconds a buffered reading may wait before being flushed
+
+def get_parameter_columns():
+    """Fetches the ordered parameter catalog that defines the wide-row columns."""
+    conn = psycopg2.connect(host=DB_HOST, port=DB_PORT, user=DB_USER, password=DB_PASSWORD, dbname=DB_NAME)
+    cursor = conn.cursor()
+    cursor.execute("SELECT parameter_type_id, code FROM parameterType ORDER BY parameter_type_id;")
+    columns = cursor.fetchall()
+    cursor.close()
+    conn.close()
+    return columns
 
 def get_ingestion_metadata():
     """Fetches metadata needed for polling and inserting."""
     conn = psycopg2.connect(host=DB_HOST, port=DB_PORT, user=DB_USER, password=DB_PASSWORD, dbname=DB_NAME)
     cursor = conn.cursor()
-    
+
     query = """
     SELECT dpm.mapping_id, wh.wellhead_id, pt.parameter_type_id, dpm.modbus_register, pt.data_type
     FROM deviceParameterMapping dpm
@@ -34,90 +62,262 @@ def get_ingestion_metadata():
     metadata = cursor.fetchall()
     cursor.close()
     conn.close()
-    
-    # Convert list of tuples to a more usable list of dicts
-    ingestion_map = [
-        {"mapping_id": r[0], "wellhead_id": r[1], "param_type_id": r[2], "register": r[3], "type": r[4]}
-        for r in metadata
-    ]
+
+    # Group the mappings per wellhead so the poll loop can emit one wide row
+    # per (wellhead, timestamp) instead of one row per parameter.
+    ingestion_map = {}
+    for mapping_id, wellhead_id, param_type_id, register, data_type in metadata:
+        ingestion_map.setdefault(wellhead_id, {})[param_type_id] = {
+            "mapping_id": mapping_id, "register": register, "type": data_type
+        }
     return ingestion_map
 
-def main():
-    print("Starting Database Ingestion Service...")
-    print("Waiting for dependent services to start...")
-    time.sleep(15) # Wait for DB and Modbus server to be fully up
+def build_read_plan(ingestion_map):
+    """Precomputes one bulk read per wellhead from the register mappings.
 
-    try:
-        ingestion_map = get_ingestion_metadata()
-        if not ingestion_map:
-            print("Error: No ingestion metadata found in database.")
-            return
-        print(f"Loaded {len(ingestion_map)} parameter mappings for ingestion.")
-    except psycopg2.OperationalError as e:
-        print(f"Database connection failed: {e}")
+    The seed data lays each wellhead's parameters out contiguously, so a
+    single read_holding_registers call per wellhead replaces one roundtrip
+    per parameter. Spans wider than the Modbus 125-register limit are split
+    into chunks.
+    """
+    read_plan = {}
+    for wellhead_id, params in ingestion_map.items():
+        base = min(info['register'] for info in params.values())
+        span = max(info['register'] for info in params.values()) + 2 - base
+        chunks = [
+            (base + offset, min(MAX_READ_SPAN, span - offset))
+            for offset in range(0, span, MAX_READ_SPAN)
+        ]
+        offsets = {
+            param_type_id: (info['register'] - base, info['type'])
+            for param_type_id, info in params.items()
+        }
+        read_plan[wellhead_id] = {"chunks": chunks, "offsets": offsets}
+    return read_plan
+
+def build_row_plans(parameter_columns, read_plan):
+    """Precomputes positional decode slots for each wide-row column.
+
+    Each wellhead gets one slot per column: either None (parameter not
+    mapped) or (value_index, is_float) into the decoded 32-bit arrays.
+    The poll loop then appends values positionally without per-value dict
+    lookups or type-string comparisons.
+    """
+    row_plans = {}
+    for wellhead_id, plan in read_plan.items():
+        slots = []
+        for param_type_id, _ in parameter_columns:
+            mapping = plan["offsets"].get(param_type_id)
+            if mapping is None:
+                slots.append(None)
+            else:
+                offset, data_type = mapping
+                slots.append((offset // 2, data_type == 'float'))
+        row_plans[wellhead_id] = slots
+    return row_plans
+
+def _tune_socket(client):
+    """Disables Nagle's algorithm on the Modbus client socket.
+
+    The poll loop sends many small request frames per cycle; without
+    TCP_NODELAY the kernel delays each one waiting to coalesce more data,
+    which can add tens of milliseconds per read. Must be re-applied after
+    every reconnect because a new socket is created.
+    """
+    sock = getattr(client, 'socket', None)
+    if sock is None:
+        transport = getattr(client, 'transport', None)
+        if transport is not None:
+            sock = transport.get_extra_info('socket')
+    if sock is None:
         return
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    if hasattr(socket, 'TCP_QUICKACK'):  # Linux only
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
 
-    client = ModbusTcpClient(MODBUS_HOST, port=MODBUS_PORT)
-    
-    insert_sql = """
-        INSERT INTO parameterReading (timestamp_utc, wellhead_id, parameter_type_id, mapping_id, raw_value)
-        VALUES (%s, %s, %s, %s, %s)
+async def flush_rows(pool, columns, rows):
+    """Streams buffered wide rows to Postgres in one binary COPY.
+
+    asyncpg's copy_records_to_table speaks the binary COPY protocol from
+    its native codec layer, so the hand-rolled struct packing this service
+    used with psycopg2 is gone, and the flush no longer blocks the event
+    loop while Modbus reads are in flight. Falls back to a pipelined
+    executemany if the COPY stream is rejected, e.g. when the table
+    columns have drifted from the parameter catalog.
     """
+    async with pool.acquire() as conn:
+        try:
+            await conn.copy_records_to_table('wellhead_readings', records=rows, columns=columns)
+        except asyncpg.PostgresError as e:
+            log.warning("Binary COPY failed (%s); falling back to INSERT.", e)
+            placeholders = ', '.join(f'${i}' for i in range(1, len(columns) + 1))
+            insert_sql = f"INSERT INTO wellhead_readings ({', '.join(columns)}) VALUES ({placeholders})"
+            async with conn.transaction():
+                await conn.executemany(insert_sql, rows)
+
+def decode_register_block(registers):
+    """Decodes a register block into 32-bit values in one vectorized pass.
+
+    Every parameter is 32 bits wide with big byte order and little word
+    order, so instead of a BinaryPayloadDecoder per parameter the whole
+    block is reinterpreted at once: swap each pair of 16-bit words, then
+    view the bytes as big-endian float32 and int32 arrays. Values are
+    looked up afterwards by register offset.
+    """
+    swapped = np.asarray(registers, dtype='>u2').reshape(-1, 2)[:, ::-1].tobytes()
+    return np.frombuffer(swapped, dtype='>f4'), np.frombuffer(swapped, dtype='>i4')
+
+async def read_wellhead(client, plan):
+    """Reads one wellhead's full register block on its own connection."""
+    registers = []
+    for address, count in plan["chunks"]:
+        result = await client.read_holding_registers(address, count, slave=1)
+        if result.isError():
+            return None
+        registers.extend(result.registers)
+    return registers
+
+async def poll_forever(parameter_columns, read_plan):
+    column_names = [code for _, code in parameter_columns]
+    insert_columns = ['time', 'wellhead_id'] + column_names
+
+    # The Modbus spec forbids interleaving requests on one connection, so
+    # concurrency comes from one client (connection) per wellhead; the
+    # per-cycle reads then overlap into a single network roundtrip.
+    wellhead_ids = list(read_plan)
+    row_plans = build_row_plans(parameter_columns, read_plan)
+    clients = {wid: AsyncModbusTcpClient(MODBUS_HOST, port=int(MODBUS_PORT)) for wid in wellhead_ids}
+
+    async def connect_modbus():
+        await asyncio.gather(*(client.connect() for client in clients.values()))
+        for client in clients.values():
+            _tune_socket(client)
+
+    # Modbus hiccups and database hiccups are recovered independently, so
+    # a transient gateway error no longer tears down the (expensive to
+    # re-establish) database connection, and vice versa. The asyncpg pool
+    # replaces dead connections itself, so flush errors just retry.
+    db_pool = await asyncpg.create_pool(
+        host=DB_HOST, port=int(DB_PORT), database=DB_NAME,
+        user=DB_USER, password=DB_PASSWORD, min_size=1, max_size=4,
+    )
 
     while True:
         try:
-            conn = psycopg2.connect(host=DB_HOST, port=DB_PORT, dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD)
-            cursor = conn.cursor()
-            client.connect()
+            await connect_modbus()
+
+            # Readings are buffered across poll cycles so each flush streams
+            # one COPY batch instead of a statement per reading.
+            pending_rows = []
+            last_flush_time = time.time()
+            next_tick = time.monotonic()
 
             while True:
-                start_time = time.time()
-                records_to_insert = []
+                # One shared, tz-aware timestamp per poll cycle; checked
+                # here once instead of per buffered row.
                 current_timestamp = datetime.now(timezone.utc)
+                assert current_timestamp.tzinfo is not None
+
+                try:
+                    results = await asyncio.gather(
+                        *(read_wellhead(clients[wid], read_plan[wid]) for wid in wellhead_ids)
+                    )
+                except (ModbusException, ConnectionError, asyncio.TimeoutError, OSError) as e:
+                    log.warning("Modbus error: %s. Reconnecting Modbus clients only...", e)
+                    for client in clients.values():
+                        client.close()
+                    await asyncio.sleep(2)
+                    await connect_modbus()
+                    continue
+
+                for wellhead_id, registers in zip(wellhead_ids, results):
+                    if registers is None:
+                        log.warning("Bulk read failed for wellhead %s; skipping this cycle.", wellhead_id)
+                        continue
+                    float_values, int_values = decode_register_block(registers)
+
+                    row = [current_timestamp, wellhead_id]
+                    for slot in row_plans[wellhead_id]:
+                        if slot is None:
+                            row.append(None)
+                            continue
+                        value_index, is_float = slot
+                        row.append(float(float_values[value_index] if is_float else int_values[value_index]))
+
+                    pending_rows.append(tuple(row))
 
-                for item in ingestion_map:
-                    # Each parameter is 2 registers (32-bit)
-                    result = client.read_holding_registers(item['register'], 2, slave=1)
-                    
-                    if not result.isError():
-                        decoder = BinaryPayloadDecoder.fromRegisters(result.registers, byteorder=Endian.Big, wordorder=Endian.Little)
-                        value = None
-                        if item['type'] == 'float':
-                            value = decoder.decode_32bit_float()
-                        elif item['type'] in ['integer', 'boolean']:
-                            value = float(decoder.decode_32bit_int())
-                        
-                        if value is not None:
-                            records_to_insert.append((
-                                current_timestamp,
-                                item['wellhead_id'],
-                                item['param_type_id'],
-                                item['mapping_id'],
-                                value
-                            ))
-                
-                if records_to_insert:
-                    print(f"[{datetime.now(timezone.utc)}] {len(records_to_insert)} records ready for insert.")
-
-                    for rec in records_to_insert:
-                        if rec[0] is None:
-                            raise ValueError("Time stamp is none before insert. Check the time generation")
-                        if rec[0].tzinfo is None:
-                            raise ValueError(f"Naive datetime detected: {rec[0]}. Use datetime.now(timezone.utc).")
-
-                    execute_batch(cursor, insert_sql, records_to_insert)
-                    conn.commit()
-                    print(f"[{datetime.now(timezone.utc)}] Inserted {len(records_to_insert)} records.")
-
-                time_to_wait = POLL_INTERVAL - (time.time() - start_time)
-                if time_to_wait > 0:
-                    time.sleep(time_to_wait)
+                # Flush once enough rows have accumulated to make the COPY
+                # worthwhile, or when the oldest buffered reading is stale.
+                if pending_rows and (
+                    len(pending_rows) >= MAX_BUFFERED_ROWS
+                    or time.time() - last_flush_time >= MAX_BATCH_AGE
+                ):
+                    try:
+                        await flush_rows(db_pool, insert_columns, pending_rows)
+                    except (asyncpg.PostgresError, OSError, asyncio.TimeoutError) as e:
+                        # Keep the buffered rows and retry at the next
+                        # flush; the pool hands out a fresh connection and
+                        # Modbus polling continues undisturbed meanwhile.
+                        log.warning("Database error during flush: %s. Retrying at next flush.", e)
+                    else:
+                        log.info("Inserted %d wide rows.", len(pending_rows))
+                        pending_rows.clear()
+                        last_flush_time = time.time()
+
+                # Absolute monotonic deadlines: the period cannot drift with
+                # work time or wall-clock jumps, and overruns are reported
+                # instead of silently eating the next cycle.
+                next_tick += POLL_INTERVAL
+                lag = time.monotonic() - next_tick
+                if lag > 0:
+                    log.warning("Poll cycle overran its deadline by %.2fs.", lag)
+                    next_tick = time.monotonic()
+                else:
+                    await asyncio.sleep(next_tick - time.monotonic())
 
         except Exception as e:
-            print(f"An error occurred: {e}. Reconnecting in 10 seconds...")
-            if client.is_socket_open(): client.close()
-            if 'conn' in locals() and not conn.closed: conn.close()
-            time.sleep(10)
+            log.error("An error occurred: %s. Reconnecting in 10 seconds...", e)
+            for client in clients.values():
+                client.close()
+            await asyncio.sleep(10)
+
+def _modbus_ready():
+    client = ModbusTcpClient(MODBUS_HOST, port=int(MODBUS_PORT))
+    try:
+        if not client.connect():
+            raise ConnectionError("Modbus server not accepting connections")
+    finally:
+        client.close()
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    log.info("Starting Database Ingestion Service...")
+    log.info("Waiting for dependent services to start...")
+    wait_for(
+        lambda: psycopg2.connect(host=DB_HOST, port=DB_PORT, user=DB_USER,
+                                 password=DB_PASSWORD, dbname=DB_NAME,
+                                 connect_timeout=2).close(),
+        "database",
+    )
+    wait_for(_modbus_ready, "modbus gateway")
+
+    try:
+        parameter_columns = get_parameter_columns()
+        ingestion_map = get_ingestion_metadata()
+        if not parameter_columns or not ingestion_map:
+            log.error("No ingestion metadata found in database.")
+            return
+        read_plan = build_read_plan(ingestion_map)
+        log.info("Loaded %d parameter columns for %d wellheads.",
+                 len(parameter_columns), len(ingestion_map))
+    except psycopg2.OperationalError as e:
+        log.error("Database connection failed: %s", e)
+        return
+
+    if uvloop is not None:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        log.info("Running on the uvloop event loop.")
+    asyncio.run(poll_forever(parameter_columns, read_plan))
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
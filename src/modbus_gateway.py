@@ -1,18 +1,19 @@
-import subprocess
-import json
 import threading
 import time
 import os
+import numpy as np
 import psycopg2
-from pymodbus.server.sync import StartTcpServer
-from pymodbus.datastore import ModbusSequentialDataBlock, ModbusSlaveContext, ModbusServerContext
-from pymodbus.payload import BinaryPayloadBuilder
-from pymodbus.constants import Endian
+from pymodbus.server import StartTcpServer
+from pymodbus.datastore import ModbusSlaveContext, ModbusServerContext
+from pymodbus.datastore.store import BaseModbusDataBlock
+
+import wellhead_simulator
+from service_utils import wait_for
 
 # Config
 MODBUS_HOST = os.getenv('MODBUS_HOST', 'modbus')  # Assuming the database and simulator are in the same Docker network
 MODBUS_PORT = int(os.getenv('MODBUS_PORT', 5020))
-SIMULATOR_SCRIPT = 'wellhead_simulator.py'
+UPDATE_INTERVAL = 30  # seconds between simulated data updates
 DB_HOST = os.getenv('POSTGRES_HOST', 'db')
 DB_PORT = int(os.getenv('POSTGRES_PORT', 5432))
 DB_NAME = os.getenv('POSTGRES_DB')
@@ -21,15 +22,40 @@ DB_PASSWORD = os.getenv('POSTGRES_PASSWORD')
 
 server_context = None
 register_map = {}
+write_plan = {}
+
+def build_write_plan(mapping):
+    """Precomputes one contiguous datastore write per wellhead.
+
+    Parameters are sorted by register so the updater can assemble the
+    whole block in order and push it with a single setValues call,
+    acquiring the datastore lock once per wellhead instead of once per
+    parameter. Offsets, type masks and per-parameter deadbands are kept
+    as parallel arrays so the updater works vectorized.
+    """
+    plan = {}
+    for wellhead_id, params in mapping.items():
+        sorted_params = sorted(params.items(), key=lambda kv: kv[1]['register'])
+        base = sorted_params[0][1]['register']
+        span = sorted_params[-1][1]['register'] + 2 - base
+        plan[wellhead_id] = {
+            "base": base,
+            "span": span,
+            "codes": [code for code, _ in sorted_params],
+            "offsets": np.array([info['register'] - base for _, info in sorted_params]),
+            "float_mask": np.array([info['type'] == 'float' for _, info in sorted_params]),
+            "eps": np.array([info['precision'] or 0.0 for _, info in sorted_params]),
+        }
+    return plan
 
 def build_register_map():
     """Fetches the Modbus mapping from the database."""
-    global register_map
+    global register_map, write_plan
     conn = psycopg2.connect(host=DB_HOST, port=DB_PORT, user=DB_USER, password=DB_PASSWORD, dbname=DB_NAME)
     cursor = conn.cursor()
     
     query = """
-    SELECT wh.wellhead_id, pt.code, dpm.modbus_register, pt.data_type
+    SELECT wh.wellhead_id, pt.code, dpm.modbus_register, pt.data_type, pt.precision
     FROM deviceParameterMapping dpm
     JOIN parameterType pt ON dpm.parameter_type_id = pt.parameter_type_id
     JOIN device d ON dpm.device_id = d.device_id
@@ -38,67 +64,144 @@ def build_register_map():
     """
     cursor.execute(query)
     mappings = cursor.fetchall()
-    
+
     temp_map = {}
     for row in mappings:
-        wellhead_id, param_code, register, data_type = row
+        wellhead_id, param_code, register, data_type, precision = row
         if wellhead_id not in temp_map:
             temp_map[wellhead_id] = {}
-        temp_map[wellhead_id][param_code] = {"register": register, "type": data_type}
+        temp_map[wellhead_id][param_code] = {"register": register, "type": data_type, "precision": precision}
     
     register_map = temp_map
+    write_plan = build_write_plan(temp_map)
     print("Successfully built Modbus register map from database.")
     cursor.close()
     conn.close()
 
+class NumpyDataBlock(BaseModbusDataBlock):
+    """Sequential register block backed by a contiguous uint16 array.
+
+    ModbusSequentialDataBlock keeps a Python list and splices values in
+    element by element on every write. With a single writer (the updater
+    thread) and short reads from the server, a NumPy array makes each
+    per-wellhead update one C-level slice assignment and each read a
+    cheap slice copy, with no per-element Python work in between.
+    """
+
+    def __init__(self, address, values):
+        self.address = address
+        self.default_value = 0
+        self.values = np.asarray(values, dtype=np.uint16)
+
+    def validate(self, address, count=1):
+        """Checks whether the request is fully inside the block."""
+        if count <= 0:
+            return False
+        return self.address <= address and address + count <= self.address + len(self.values)
+
+    def getValues(self, address, count=1):
+        """Returns `count` register values starting at `address`."""
+        start = address - self.address
+        return self.values[start:start + count].tolist()
+
+    def setValues(self, address, values):
+        """Stores `values` as one contiguous slice assignment."""
+        start = address - self.address
+        self.values[start:start + len(values)] = values
+
+def encode_32bit_values(values, data_type):
+    """Packs a batch of 32-bit values into register pairs in one pass.
+
+    Mirrors the big-byte/little-word layout the ingestion side decodes:
+    each value becomes two 16-bit registers, low word first. Returns an
+    (N, 2) uint16 array, one row per value.
+    """
+    kind = '>f4' if data_type == 'float' else '>i4'
+    raw = np.asarray(values, dtype=kind).tobytes()
+    return np.frombuffer(raw, dtype='>u2').reshape(-1, 2)[:, ::-1]
+
 def data_updater_thread():
-    """Runs simulator and updates Modbus data store based on the register map."""
-    global server_context, register_map
-    
+    """Generates simulator data in-process and updates the Modbus data store.
+
+    The simulator is imported and called directly rather than spawned as a
+    subprocess, so no JSON is serialized, piped and parsed on the hot path.
+    """
+    global server_context, register_map, write_plan
+
     print("Starting data updater thread...")
-    process = subprocess.Popen(['python', SIMULATOR_SCRIPT], stdout=subprocess.PIPE, text=True)
+    engine = wellhead_simulator.SimulationEngine.from_database()
+
+    # Last-written register block and values per wellhead: values that
+    # have not moved past their deadband are neither repacked nor
+    # rewritten, and an untouched wellhead skips its datastore write.
+    last_registers = {}
+    last_values = {}
 
+    # Same drift-free scheduling as the simulator loop: advance an
+    # absolute monotonic deadline instead of sleeping the fixed interval.
+    next_deadline = time.monotonic()
     while True:
-        output = process.stdout.readline()
-        if output:
-            try:
-                wellhead_data_list = json.loads(output.strip())
-                
-                for data_point in wellhead_data_list:
-                    wellhead_id = data_point['wellhead_id']
-                    
-                    if wellhead_id not in register_map:
-                        continue
-
-                    for param_code, value in data_point['parameters'].items():
-                        if param_code in register_map[wellhead_id]:
-                            mapping_info = register_map[wellhead_id][param_code]
-                            register_addr = mapping_info['register']
-                            param_type = mapping_info['type']
-                            
-                            builder = BinaryPayloadBuilder(byteorder=Endian.Big, wordorder=Endian.Little)
-                            
-                            if param_type == 'float':
-                                builder.add_32bit_float(float(value))
-                            elif param_type in ['integer', 'boolean']:
-                                builder.add_32bit_int(int(value))
-                            
-                            payload = builder.to_registers()
-                            server_context[0x00].setValues(3, register_addr, payload)
-
-            except (json.JSONDecodeError, KeyError) as e:
-                print(f"Error processing data from simulator: {e}")
-        
-        if process.poll() is not None:
-            print("Simulator process has terminated.")
-            break
-        time.sleep(0.1)
+        wellhead_data_list = engine.tick()
+
+        for data_point in wellhead_data_list:
+            wellhead_id = data_point['wellhead_id']
+
+            if wellhead_id not in write_plan:
+                continue
+
+            parameters = data_point['parameters']
+            plan = write_plan[wellhead_id]
+            if wellhead_id not in last_registers:
+                last_registers[wellhead_id] = np.zeros(plan['span'], dtype='>u2')
+                last_values[wellhead_id] = np.full(len(plan['codes']), np.nan)
+            registers = last_registers[wellhead_id]
+            previous = last_values[wellhead_id]
+
+            values = np.array([
+                parameters.get(code, previous[i])
+                for i, code in enumerate(plan['codes'])
+            ], dtype=np.float64)
+
+            # Deadband filter: NaN (first cycle) compares unequal, so
+            # everything is written initially.
+            changed = ~(np.abs(values - previous) <= plan['eps'])
+            if not changed.any():
+                continue
+
+            # Pack only the changed values of each kind, in one
+            # vectorized call instead of a builder per parameter.
+            for kind_mask, np_kind in ((plan['float_mask'], 'float'), (~plan['float_mask'], 'int')):
+                selected = changed & kind_mask
+                if not selected.any():
+                    continue
+                register_pairs = encode_32bit_values(values[selected], np_kind)
+                offsets = plan['offsets'][selected]
+                registers[offsets] = register_pairs[:, 0]
+                registers[offsets + 1] = register_pairs[:, 1]
+
+            previous[changed] = values[changed]
+
+            # One contiguous write per wellhead: a single datastore
+            # lock acquisition instead of one per parameter.
+            server_context[0x00].setValues(3, plan['base'], registers.tolist())
+
+        next_deadline += UPDATE_INTERVAL
+        delay = next_deadline - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            next_deadline = time.monotonic()
 
 def run_modbus_server():
     """Initializes and runs the Modbus TCP server."""
     global server_context
-    # Initialize with a large enough block, e.g., 1000 registers
-    store = ModbusSlaveContext(hr=ModbusSequentialDataBlock(0, [0] * 1000))
+    # Size the block from the register map (+2 for the slave context's
+    # one-based addressing); the old fixed 1000-register list silently
+    # misplaced writes for wellheads mapped beyond its end.
+    size = 1000
+    if write_plan:
+        size = max(plan['base'] + plan['span'] for plan in write_plan.values()) + 2
+    store = ModbusSlaveContext(hr=NumpyDataBlock(0, [0] * size))
     server_context = ModbusServerContext(slaves=store, single=True)
 
     print(f"Starting Modbus TCP server on {MODBUS_HOST}:{MODBUS_PORT}...")
@@ -106,7 +209,12 @@ def run_modbus_server():
 
 if __name__ == "__main__":
     print("Modbus Gateway waiting for database to be ready...")
-    time.sleep(10)
+    wait_for(
+        lambda: psycopg2.connect(host=DB_HOST, port=DB_PORT, user=DB_USER,
+                                 password=DB_PASSWORD, dbname=DB_NAME,
+                                 connect_timeout=2).close(),
+        "database",
+    )
     try:
         build_register_map()
         updater = threading.Thread(target=data_updater_thread, daemon=True)
@@ -0,0 +1,21 @@
+import time
+
+def wait_for(check, name, timeout=60, base_delay=0.1):
+    """Polls a readiness check until it succeeds, with exponential backoff.
+
+    Replaces fixed startup sleeps: the service continues the instant its
+    dependency is reachable instead of always paying the worst case.
+    Raises TimeoutError if the dependency is still down after `timeout`
+    seconds.
+    """
+    deadline = time.time() + timeout
+    delay = base_delay
+    while True:
+        try:
+            check()
+            return
+        except Exception as e:
+            if time.time() >= deadline:
+                raise TimeoutError(f"{name} not ready after {timeout}s: {e}") from e
+            time.sleep(delay)
+            delay = min(delay * 2, 2)
@@ -1,9 +1,14 @@
-import json
-import random
+import io
+import queue
+import sys
+import threading
 import time
 import os
+import numpy as np
+import orjson
 import psycopg2
-from datetime import datetime
+
+from service_utils import wait_for
 
 # Database connection details from environment variables
 DB_HOST = os.getenv('POSTGRES_HOST', 'db')
@@ -11,12 +16,22 @@ DB_PORT = os.getenv('POSTGRES_PORT', 5432)
 DB_NAME = os.getenv('POSTGRES_DB')
 DB_USER = os.getenv('POSTGRES_USER')
 DB_PASSWORD = os.getenv('POSTGRES_PASSWORD')
+# Optional path for a latest-tick snapshot file, for consumers that want
+# to poll a file instead of following stdout. Unset by default.
+SNAPSHOT_FILE = os.getenv('WELLHEAD_SNAPSHOT_FILE')
+
+# Integer type codes, resolved once at metadata load so the per-tick path
+# compares small ints instead of strings.
+TYPE_FLOAT, TYPE_INTEGER, TYPE_BOOLEAN = 0, 1, 2
+TYPE_CODES = {'float': TYPE_FLOAT, 'integer': TYPE_INTEGER, 'boolean': TYPE_BOOLEAN}
+
+# One shared Generator for the whole process: seeding the bit generator
+# is not free and every simulation state drawing from its own instance
+# buys nothing, since all draws happen on the single tick thread.
+_RNG = np.random.default_rng()
 
 def get_simulation_metadata():
     """Fetches wellhead and parameter info from the database."""
-    conn = psycopg2.connect(host=DB_HOST, port=DB_PORT, user=DB_USER, password=DB_PASSWORD, dbname=DB_NAME)
-    cursor = conn.cursor()
-    
     # Fetch all active wellheads and their associated parameter types
     query = """
     SELECT wh.wellhead_id, pt.code, pt.normal_min, pt.normal_max, pt.data_type
@@ -26,60 +41,244 @@ def get_simulation_metadata():
     JOIN parameterType pt ON dpm.parameter_type_id = pt.parameter_type_id
     WHERE wh.status = 'active' AND dpm.active = TRUE;
     """
-    cursor.execute(query)
-    metadata = cursor.fetchall()
-    
-    cursor.close()
-    conn.close()
-    
-    # Structure the metadata for easy use
-    sim_config = {}
-    for row in metadata:
-        wellhead_id, param_code, min_val, max_val, data_type = row
-        if wellhead_id not in sim_config:
-            sim_config[wellhead_id] = []
-        sim_config[wellhead_id].append({
-            "code": param_code,
-            "min": min_val,
-            "max": max_val,
-            "type": data_type
-        })
-    return sim_config
+    # Context-managed connection and cursor: a failure mid-fetch can no
+    # longer leak the socket. The named cursor streams rows from the
+    # server instead of buffering the whole result in libpq first, and a
+    # transient connection error gets one retry before giving up.
+    for attempt in (1, 2):
+        try:
+            conn = psycopg2.connect(host=DB_HOST, port=DB_PORT, user=DB_USER,
+                                    password=DB_PASSWORD, dbname=DB_NAME)
+            try:
+                with conn, conn.cursor(name='simulation_metadata') as cursor:
+                    cursor.execute(query)
+                    # Structure the metadata for easy use; iterating the
+                    # cursor streams rows straight into the config with no
+                    # intermediate list of the full result.
+                    sim_config = {}
+                    for wellhead_id, param_code, min_val, max_val, data_type in cursor:
+                        if wellhead_id not in sim_config:
+                            sim_config[wellhead_id] = []
+                        sim_config[wellhead_id].append({
+                            "code": param_code,
+                            "min": min_val,
+                            "max": max_val,
+                            "type": TYPE_CODES[data_type]
+                        })
+            finally:
+                conn.close()
+            return sim_config
+        except psycopg2.OperationalError as e:
+            if attempt == 2:
+                raise
+            print(f"Metadata fetch failed ({e}); retrying...")
+            time.sleep(1)
+
+def get_file_config(path, wellhead_count=1):
+    """Builds a simulation config from a parameters.json-style file.
+
+    Config source for running the simulator without a database. The file
+    carries display names and "low"/"high" bounds; they are normalized
+    once at load into the same shape get_simulation_metadata produces
+    (codes, "min"/"max", integer type codes), so everything downstream
+    is source-agnostic and no per-tick key translation is needed.
+    """
+    with open(path, 'rb') as f:
+        raw = orjson.loads(f.read())
+    params = [{
+        "code": entry["name"].lower().replace(' ', '_'),
+        "min": entry["low"],
+        "max": entry["high"],
+        "type": TYPE_CODES[entry["type"]],
+    } for entry in raw]
+    return {wellhead_id: params for wellhead_id in range(1, wellhead_count + 1)}
+
+def _utc_isoformat():
+    """Renders the current UTC time in the datetime.isoformat() layout.
+
+    One time_ns read, one gmtime call and one %-format; cheaper than
+    constructing a datetime object per tick just to format and drop it.
+    """
+    seconds, nanos = divmod(time.time_ns(), 1_000_000_000)
+    tm = time.gmtime(seconds)
+    return '%04d-%02d-%02dT%02d:%02d:%02d.%06d' % (
+        tm.tm_year, tm.tm_mon, tm.tm_mday,
+        tm.tm_hour, tm.tm_min, tm.tm_sec, nanos // 1000,
+    )
+
+class SimulationEngine:
+    """The one simulation core, shared by run_simulation and the gateway.
+
+    Construction flattens a config — from whichever source — into the
+    tick-ready layout: every (wellhead, parameter) slot becomes one index
+    into flat min/max columns, slots are bucketed by type, and each
+    wellhead keeps a persistent output dict that ticks overwrite in
+    place. A tick's batch is therefore only valid until the next tick.
+    Having a single engine means each hot-path change lands once instead
+    of once per consumer.
+    """
+
+    def __init__(self, config):
+        entries = []
+        mins, maxs, types = [], [], []
+        for wellhead_id, params in config.items():
+            start = len(mins)
+            for param in params:
+                mins.append(param["min"])
+                maxs.append(param["max"])
+                types.append(param["type"])
+            codes = tuple(param["code"] for param in params)
+            template = {
+                "timestamp": "",
+                "wellhead_id": wellhead_id,
+                "parameters": {code: 0.0 for code in codes},
+            }
+            entries.append((wellhead_id, codes, start, template))
+        self.entries = entries
+        self.batch = [entry[3] for entry in entries]
+        self.slot_values = [0.0] * len(mins)
+        self.mins = np.asarray(mins, dtype=np.float64)
+        self.maxs = np.asarray(maxs, dtype=np.float64)
+        # Outlier-widened bounds, scaled once here so the tick selects
+        # between ready-made columns instead of recomputing the scaling.
+        self.mins_outlier = self.mins * 0.8
+        self.maxs_outlier = self.maxs * 1.2
+        # Bucket the slots by type once: each tick then converts one
+        # bucket per type in a vectorized pass instead of testing the
+        # type per slot. The *_idx arrays drive the fancy indexing, the
+        # *_pos lists the scatter back into per-slot order.
+        self.types = np.asarray(types, dtype=np.int8)
+        self.float_idx = np.flatnonzero(self.types == TYPE_FLOAT)
+        self.int_idx = np.flatnonzero(self.types == TYPE_INTEGER)
+        self.bool_idx = np.flatnonzero(self.types == TYPE_BOOLEAN)
+        self.float_pos = self.float_idx.tolist()
+        self.int_pos = self.int_idx.tolist()
+        self.bool_pos = self.bool_idx.tolist()
+        self.rng = _RNG
+
+    @classmethod
+    def from_database(cls):
+        """Builds an engine from the metadata tables."""
+        return cls(get_simulation_metadata())
+
+    @classmethod
+    def from_file(cls, path, wellhead_count=1):
+        """Builds an engine from a parameters.json-style file."""
+        return cls(get_file_config(path, wellhead_count))
+
+    def tick(self):
+        """Generates one batch of readings for every wellhead."""
+        rng = self.rng
+
+        # One vectorized draw for every (wellhead, parameter) slot, with
+        # a 10% chance per slot of being outside the normal thresholds.
+        # Booleans get their own batched integer draw instead of
+        # thresholding the uniform.
+        outlier = rng.random(len(self.mins)) < 0.1
+        low = np.where(outlier, self.mins_outlier, self.mins)
+        high = np.where(outlier, self.maxs_outlier, self.maxs)
+        values = rng.uniform(low, high)
+
+        # Convert one type bucket at a time and scatter into per-slot
+        # order; the per-wellhead loop below then assigns values
+        # uniformly with no type test per slot. Every slot of the scratch
+        # list is overwritten each tick, so no clearing is needed, and
+        # the slots hold numpy scalars as-is — orjson walks them in C via
+        # OPT_SERIALIZE_NUMPY, so nothing is boxed just to be serialized.
+        slot_values = self.slot_values
+        float_values = values[self.float_idx]
+        np.round(float_values, 2, out=float_values)
+        for pos, value in zip(self.float_pos, float_values):
+            slot_values[pos] = value
+        for pos, value in zip(self.int_pos, values[self.int_idx].astype(np.int64)):
+            slot_values[pos] = value
+        bool_draws = rng.integers(0, 2, len(self.bool_pos))
+        for pos, value in zip(self.bool_pos, bool_draws):
+            slot_values[pos] = value
+
+        # One wall-clock read and ISO conversion per tick; every wellhead
+        # in the batch shares the same timestamp anyway.
+        timestamp = _utc_isoformat()
+
+        for wellhead_id, codes, start, data_point in self.entries:
+            data_point["timestamp"] = timestamp
+            parameters = data_point["parameters"]
+            for i, code in enumerate(codes, start):
+                parameters[code] = slot_values[i]
+        return self.batch
+
+    def serialize_tick(self):
+        """Generates one batch and renders it as a JSON line."""
+        return orjson.dumps(
+            self.tick(),
+            option=orjson.OPT_APPEND_NEWLINE | orjson.OPT_SERIALIZE_NUMPY,
+        )
+
+def write_snapshot(path, payload):
+    """Atomically replaces the snapshot file with the given payload.
+
+    Writing to a sibling temp file and os.replace-ing it over the target
+    means a reader racing with the writer always sees a complete
+    document, never a truncated one.
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(payload)
+    os.replace(tmp_path, path)
 
 def run_simulation(config, interval_seconds=30):
     """Runs the simulation based on the provided config."""
     print("Starting Wellhead Simulator with metadata from database...")
+    engine = SimulationEngine(config)
+    # A 64 KB buffer makes each tick's write at most one syscall regardless
+    # of batch size; the explicit flush keeps downstream latency at one
+    # tick, which is what a line-oriented consumer expects.
+    out = io.BufferedWriter(sys.stdout.buffer, buffer_size=65536)
+
+    # The write side (stdout syscall plus the optional snapshot replace)
+    # runs on its own thread behind a small bounded queue, so an I/O stall
+    # overlaps with the next tick's generation instead of delaying it.
+    # Serialization stays on the producer side because the batch dicts are
+    # reused in place and would race with the next tick if handed over
+    # raw; the queue bound applies backpressure rather than buffering
+    # without limit if the consumer of stdout stops reading.
+    payload_queue = queue.Queue(maxsize=4)
+
+    def write_payloads():
+        while True:
+            payload = payload_queue.get()
+            out.write(payload)
+            out.flush()
+            if SNAPSHOT_FILE:
+                write_snapshot(SNAPSHOT_FILE, payload)
+
+    threading.Thread(target=write_payloads, daemon=True).start()
+
+    # Absolute monotonic deadlines: sleeping the fixed interval after each
+    # tick would stretch the period by the work time, so the deadline is
+    # advanced instead and the sleep absorbs whatever time is left.
+    next_deadline = time.monotonic()
     while True:
-        all_data = []
-        for wellhead_id, params in config.items():
-            data_point = {
-                "timestamp": datetime.utcnow().isoformat(),
-                "wellhead_id": wellhead_id,
-                "parameters": {}
-            }
-            for param in params:
-                # Generate a value with a 10% chance of being outside thresholds
-                if random.random() < 0.1:
-                    value = random.uniform(param["min"] * 0.8, param["max"] * 1.2)
-                else:
-                    value = random.uniform(param["min"], param["max"])
-                
-                if param["type"] == 'float':
-                    data_point["parameters"][param["code"]] = round(value, 2)
-                elif param["type"] == 'boolean':
-                    data_point["parameters"][param["code"]] = random.choice([0, 1])
-                else: # integer
-                    data_point["parameters"][param["code"]] = int(value)
-            all_data.append(data_point)
-        
-        # Print as a single JSON line 
-        print(json.dumps(all_data))
-        time.sleep(interval_seconds)
+        # Emit one JSON line per tick; orjson serializes at C speed and
+        # returns bytes, so the batch goes straight to the writer thread.
+        payload_queue.put(engine.serialize_tick())
+        next_deadline += interval_seconds
+        delay = next_deadline - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            next_deadline = time.monotonic()
 
 if __name__ == "__main__":
     print("Simulator waiting for database to be ready...")
-    time.sleep(10) # Simple delay to wait for DB initialization
-    
+    wait_for(
+        lambda: psycopg2.connect(host=DB_HOST, port=DB_PORT, user=DB_USER,
+                                 password=DB_PASSWORD, dbname=DB_NAME,
+                                 connect_timeout=2).close(),
+        "database",
+    )
+
+
     try:
         simulation_config = get_simulation_metadata()
         if not simulation_config: